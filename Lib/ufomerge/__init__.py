@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import copy
+import functools
+import itertools
 from io import StringIO
 import logging
-from collections import defaultdict
+import re
+from collections import defaultdict, deque
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, Iterable, Mapping, OrderedDict, Set, Tuple, Optional
@@ -14,10 +17,48 @@ from ufoLib2 import Font
 from ufoLib2.objects import LayerSet, Layer, Glyph, Anchor
 
 from ufomerge.layout import LayoutClosureVisitor, LayoutSubsetter
+from ufomerge.utils import LazyJoin, OrderedGlyphSet, clone_ast
 
 logger = logging.getLogger("ufomerge")
 logging.basicConfig(level=logging.INFO)
 
+# Comments and strings are matched too, so that anything inside them is
+# skipped over; only matches with a script are languagesystem statements.
+LANGUAGESYSTEM_RE = re.compile(
+    r'#[^\n]*|"[^"]*"'
+    r"|(?<![\w.-])languagesystem\s+(?P<script>[^\s;#]+)\s+(?P<language>[^\s;#]+)\s*;"
+)
+
+
+# Only the most recent feature file is kept, which covers the common case of
+# merging from the same donor font several times in a row.
+@functools.lru_cache(maxsize=1)
+def _parse_feature_file(
+    text: str, include_dir: Path | None, glyph_names: Tuple[str, ...]
+) -> ast.FeatureFile:
+    return Parser(
+        StringIO(text), includeDir=include_dir, glyphNames=glyph_names
+    ).parse()
+
+
+def _parse_features(
+    text: str, include_dir: Path | None, glyph_names: Iterable[str]
+) -> ast.FeatureFile:
+    """Parse a feature file, reusing the result of an identical earlier parse.
+
+    Merging or subsetting from the same donor font several times is common,
+    and parsing is by far the most expensive step. The AST is mutated while
+    merging, so callers get their own copy of the cached tree.
+
+    Feature files which include others are always parsed afresh, as the
+    included files may have changed since.
+    """
+    if "include" in text:
+        return Parser(
+            StringIO(text), includeDir=include_dir, glyphNames=tuple(glyph_names)
+        ).parse()
+    return clone_ast(_parse_feature_file(text, include_dir, tuple(glyph_names)))
+
 
 @dataclass
 class UFOMerger:
@@ -32,8 +73,7 @@ class UFOMerger:
     merge_dotted_circle_anchors: bool = True
 
     original_glyphlist: Iterable[str] | None = None
-    # We would like to use a set here, but we need order preservation
-    incoming_glyphset: dict[str, bool] = field(init=False)
+    incoming_glyphset: OrderedGlyphSet = field(init=False)
     final_glyphset: Set[str] = field(init=False)
     blacklisted: Set[str] = field(init=False)
     ufo2_features: ast.FeatureFile = field(init=False)
@@ -52,28 +92,42 @@ class UFOMerger:
         if not self.glyphs and not self.codepoints:
             self.glyphs = self.ufo2.keys()
 
-        self.incoming_glyphset = dict.fromkeys(self.glyphs, True)
+        self.incoming_glyphset = OrderedGlyphSet.fromkeys(self.glyphs)
         self.blacklisted = set([])
 
         self.dotted_circle_anchors = self.merged_dotted_circle_anchors()
 
         # Now add codepoints
         if self.codepoints:
-            existing_map = {}
-            to_delete = defaultdict(list)
-            for glyph in self.ufo1:
-                for cp in glyph.unicodes:
-                    existing_map[cp] = glyph.name
-
+            # Callers may hand us any iterable; we need fast membership tests
+            self.codepoints = frozenset(self.codepoints)
+            # Only the requested codepoints can ever be looked up here
+            existing_map = {
+                cp: glyph.name
+                for glyph in self.ufo1
+                for cp in glyph.unicodes
+                if cp in self.codepoints
+            }
+            to_delete = defaultdict(set)
+
+            # Bind loop invariants to locals for the scan over the donor font
+            wanted = self.codepoints
+            exclude_glyphs = set(self.exclude_glyphs)
+            skip_existing = self.existing_handling == "skip"
+            replace_existing = self.existing_handling == "replace"
+            incoming = self.incoming_glyphset
             for glyph in self.ufo2:
-                for cp in glyph.unicodes:
-                    if cp in self.codepoints:
-                        if glyph.name in self.exclude_glyphs:
+                unicodes = glyph.unicodes
+                if wanted.isdisjoint(unicodes):
+                    continue
+                for cp in unicodes:
+                    if cp in wanted:
+                        if glyph.name in exclude_glyphs:
                             # Seriously?
                             continue
                         # But see if we have a corresponding glyph already
                         if cp in existing_map:
-                            if self.existing_handling == "skip":
+                            if skip_existing:
                                 logger.info(
                                     "Skipping codepoint U+%04X already present as '%s' in target file",
                                     cp,
@@ -82,23 +136,21 @@ class UFOMerger:
                                 # Blacklist this glyph (it may come back
                                 # because of layout/component closure.)
                                 self.blacklisted.add(glyph.name)
-                            elif self.existing_handling == "replace":
-                                to_delete[existing_map[cp]].append(cp)
+                            elif replace_existing:
+                                to_delete[existing_map[cp]].add(cp)
                         if glyph.name is not None:
-                            self.incoming_glyphset[glyph.name] = True
+                            incoming.add(glyph.name)
 
             for glyph in self.blacklisted:
-                del self.incoming_glyphset[glyph]
+                self.incoming_glyphset.discard(glyph)
 
             # Clear up any glyphs for UFO1 we don't want any more
             for glyphname, codepoints in to_delete.items():
-                self.ufo1[glyphname].unicodes = list(
-                    set(self.ufo1[glyphname].unicodes) - set(codepoints)
-                )
-                codepoints_string = ", ".join("U+%04X" % cp for cp in codepoints)
+                target = self.ufo1[glyphname]
+                target.unicodes = [cp for cp in target.unicodes if cp not in codepoints]
                 logger.info(
                     "Removing mappings %s from glyph '%s' due to incoming codepoints",
-                    codepoints_string,
+                    LazyJoin(", ", codepoints, "U+%04X"),
                     glyphname,
                 )
                 # We *could* delete it from the target glyphset, but there
@@ -106,33 +158,39 @@ class UFOMerger:
                 # feature file?! So we don't.
 
         for glyph in self.exclude_glyphs:
-            if glyph in self.incoming_glyphset:
-                del self.incoming_glyphset[glyph]
+            self.incoming_glyphset.discard(glyph)
 
         # Check those glyphs actually are in UFO 2
-        not_there = set(self.incoming_glyphset) - set(self.ufo2.keys())
+        ufo2 = self.ufo2
+        not_there = [glyph for glyph in self.incoming_glyphset if glyph not in ufo2]
         if len(not_there):
             logger.warning(
-                "The following glyphs were not in UFO 2: %s", ", ".join(not_there)
+                "The following glyphs were not in UFO 2: %s", LazyJoin(", ", not_there)
             )
             for glyph in not_there:
-                del self.incoming_glyphset[glyph]
-
-        self.final_glyphset = set(self.ufo1.keys()) | set(self.incoming_glyphset)
-
-        # Set up UFO2 features
-        if self.layout_handling != "ignore":
+                self.incoming_glyphset.discard(glyph)
+
+        self.final_glyphset = set(self.ufo1.keys())
+        self.final_glyphset.update(self.incoming_glyphset)
+
+        # Set up UFO2 features. Parsing is expensive, so don't bother when
+        # there is nothing to parse or merge() will have nothing to do.
+        if (
+            self.layout_handling != "ignore"
+            and self.incoming_glyphset
+            and self.ufo2.features.text.strip()
+        ):
             ufo2path = getattr(self.ufo2, "_path", None)
             includeDir = (
                 self.include_dir
                 if self.include_dir is not None
                 else Path(ufo2path).parent if ufo2path else None
             )
-            self.ufo2_features = Parser(
-                StringIO(self.ufo2.features.text),
-                includeDir=includeDir,
-                glyphNames=self.original_glyphlist or list(self.ufo2.keys()),
-            ).parse()
+            self.ufo2_features = _parse_features(
+                self.ufo2.features.text,
+                includeDir,
+                self.original_glyphlist or self.ufo2.keys(),
+            )
         else:
             self.ufo2_features = ast.FeatureFile()
 
@@ -154,31 +212,38 @@ class UFOMerger:
             # processing bar1 but by this time it's too late to see
             # that this impacts upon C. I'm just going to keep running
             # until the output is stable
-            count = len(self.final_glyphset)
             rounds = 0
+            # Reuse one visitor so its glyph set cache survives between rounds
+            closure_visitor = LayoutClosureVisitor(
+                incoming_glyphset=self.incoming_glyphset,
+                glyphset=self.final_glyphset,
+            )
             while True:
-                LayoutClosureVisitor(
-                    incoming_glyphset=self.incoming_glyphset,
-                    glyphset=self.final_glyphset,
-                ).visit(self.ufo2_features)
+                closure_visitor.changed = False
+                closure_visitor.visit(self.ufo2_features)
                 rounds += 1
-                if len(self.final_glyphset) == count:
+                if not closure_visitor.changed:
                     break
                 if rounds > 10:
                     raise ValueError(
                         "Layout closure failure; glyphset grew unreasonably"
                     )
-                count = len(self.final_glyphset)
 
         if self.layout_handling != "ignore":
             subsetter = LayoutSubsetter(glyphset=self.final_glyphset)
             subsetter.subset(self.ufo2_features)
-            self.ufo1.features.text += "\n" + self.ufo2_features.asFea()
+            features = self.ufo2_features.asFea()
+            # Subsetting can leave references to glyphs or classes which are
+            # no longer defined; fail here rather than write out a feature
+            # file which won't compile. Only the incoming rules are checked,
+            # which is much cheaper than reparsing the whole of ufo1's file.
+            Parser(StringIO(features), glyphNames=self.final_glyphset).parse()
+            self.ufo1.features.text += "\n" + features
             self.add_language_systems(subsetter.incoming_language_systems)
 
-        # list() avoids "Set changed size during iteration" error
-        for glyph in list(self.incoming_glyphset.keys()):
-            self.close_components(glyph)
+        # close_components seeds its worklist from a copy, so it is free to
+        # add to the incoming glyphset as it goes
+        self.close_components(self.incoming_glyphset)
 
         for glyph in self.blacklisted:
             if glyph in self.incoming_glyphset:
@@ -186,27 +251,46 @@ class UFOMerger:
 
         self.merge_kerning()
 
+        skip_existing = self.existing_handling == "skip"
+        # Font item access just forwards to the default layer
+        layer1 = self.ufo1.layers.defaultLayer
+        layer2 = self.ufo2.layers.defaultLayer
+        added = []
+
         # Now do the add, first deal with the default layer.
-        for glyph in self.incoming_glyphset.keys():
-            if self.existing_handling == "skip" and glyph in self.ufo1:
+        for glyph in self.incoming_glyphset:
+            in_target = glyph in layer1
+            if skip_existing and in_target:
                 logger.info("Skipping glyph '%s' already present in target file", glyph)
                 continue
+            added.append(glyph)
 
-            self.merge_set("public.glyphOrder", glyph, create_if_not_in_ufo1=False)
-            self.merge_set("public.skipExportGlyphs", glyph, create_if_not_in_ufo1=True)
-            self.merge_dict("public.postscriptNames", glyph, create_if_not_in_ufo1=True)
-            self.merge_dict(
-                "public.openTypeCategories", glyph, create_if_not_in_ufo1=True
-            )
-
-            if glyph in self.ufo1:
-                self.ufo1[glyph] = self.ufo2[glyph]
+            if in_target:
+                layer1[glyph] = layer2[glyph]
             else:
-                self.ufo1.addGlyph(self.ufo2[glyph])
+                layer1.addGlyph(layer2[glyph])
+
+        # Lib keys are merged a key at a time, for all the added glyphs at once
+        self.merge_set_many("public.glyphOrder", added, create_if_not_in_ufo1=False)
+        self.merge_set_many(
+            "public.skipExportGlyphs", added, create_if_not_in_ufo1=True
+        )
+        self.merge_dict_many(
+            "public.postscriptNames", added, create_if_not_in_ufo1=True
+        )
+        self.merge_dict_many(
+            "public.openTypeCategories", added, create_if_not_in_ufo1=True
+        )
 
         # ... and then the other layers.
+        default_layer_name = self.ufo2.layers.defaultLayer.name
         for ufo2_layer in self.ufo2.layers:
-            if ufo2_layer.name == self.ufo2.layers.defaultLayer.name:
+            if ufo2_layer.name == default_layer_name:
+                continue
+            relevant = [
+                glyph for glyph in self.incoming_glyphset if glyph in ufo2_layer
+            ]
+            if not relevant:
                 continue
             ufo1_layer = self.ufo1.layers.get(ufo2_layer.name)
             if ufo1_layer is None:
@@ -215,15 +299,14 @@ class UFOMerger:
                     ufo2_layer.name,
                 )
                 continue
-            for glyph in self.incoming_glyphset.keys():
-                if glyph not in ufo2_layer:
-                    continue
-                if self.existing_handling == "skip" and glyph in ufo1_layer:
+            for glyph in relevant:
+                in_target = glyph in ufo1_layer
+                if skip_existing and in_target:
                     logger.info(
                         "Skipping glyph '%s' already present in target file", glyph
                     )
                     continue
-                if glyph in ufo1_layer:
+                if in_target:
                     ufo1_layer[glyph] = ufo2_layer[glyph]
                 else:
                     ufo1_layer.addGlyph(ufo2_layer[glyph])
@@ -231,31 +314,42 @@ class UFOMerger:
         # Fixups
         self.handle_dotted_circle()
 
-    def close_components(self, glyph: str):
-        """Add any needed components, recursively"""
-        components = self.ufo2[glyph].components
-        if not components:
-            return
-        for comp in components:
-            base_glyph = comp.baseGlyph
-            if base_glyph not in self.final_glyphset:
-                # Well, this is the easy case
-                self.final_glyphset.add(base_glyph)
-                logger.debug("Adding %s used as a component in %s", base_glyph, glyph)
-                self.incoming_glyphset[base_glyph] = True
-                self.close_components(base_glyph)
-            elif self.existing_handling == "replace":
-                # Also not a problem
-                self.incoming_glyphset[base_glyph] = True
-                self.close_components(base_glyph)
-            elif base_glyph in self.ufo1:
-                # Oh bother.
-                logger.warning(
-                    "New glyph %s used component %s which already exists in font;"
-                    " not replacing it, as you have not specified --replace-existing",
-                    glyph,
-                    base_glyph,
-                )
+    def close_components(self, glyphs: Iterable[str]):
+        """Add any needed components of the given glyphs, recursively"""
+        layer2 = self.ufo2.layers.defaultLayer
+        final = self.final_glyphset
+        incoming = self.incoming_glyphset
+        replace_existing = self.existing_handling == "replace"
+        todo = deque(glyphs)
+        seen = set()
+        while todo:
+            glyph = todo.popleft()
+            if glyph in seen:
+                continue
+            seen.add(glyph)
+            for comp in layer2[glyph].components:
+                base_glyph = comp.baseGlyph
+                if base_glyph not in final:
+                    # Well, this is the easy case
+                    final.add(base_glyph)
+                    logger.debug(
+                        "Adding %s used as a component in %s", base_glyph, glyph
+                    )
+                    incoming.add(base_glyph)
+                    todo.append(base_glyph)
+                elif replace_existing:
+                    # Also not a problem
+                    incoming.add(base_glyph)
+                    if base_glyph not in seen:
+                        todo.append(base_glyph)
+                elif base_glyph in self.ufo1:
+                    # Oh bother.
+                    logger.warning(
+                        "New glyph %s used component %s which already exists in font;"
+                        " not replacing it, as you have not specified --replace-existing",
+                        glyph,
+                        base_glyph,
+                    )
 
     def filter_glyphs_incoming(self, glyphs: Iterable[str]) -> list[str]:
         return [glyph for glyph in glyphs if glyph in self.incoming_glyphset]
@@ -263,114 +357,131 @@ class UFOMerger:
     def add_language_systems(self, incoming_languagesystems):
         if not incoming_languagesystems:
             return
-        featurefile = Parser(
-            StringIO(self.ufo1.features.text), glyphNames=list(self.final_glyphset)
-        ).parse()
-
-        new_lss = []
-        first_lss_index = None
-        last_lss_index = None
-        # Add existing ones
-        for ix, lss in enumerate(featurefile.statements):
-            if isinstance(lss, ast.LanguageSystemStatement):
-                new_lss.append((lss.script, lss.language))
-                if first_lss_index is None:
-                    first_lss_index = ix
-                last_lss_index = ix
-
+        # languagesystem statements can only appear at the top level, so find
+        # them textually rather than parsing (and reformatting) the whole of
+        # ufo1's feature file. The existing statements are left where they
+        # are, and new ones are inserted around them.
+        text = self.ufo1.features.text
+        existing = [
+            match for match in LANGUAGESYSTEM_RE.finditer(text) if match["script"]
+        ]
+        # (Tags are padded to four characters, as feaLib does.)
+        present = {
+            (match["script"].ljust(4), match["language"].ljust(4)) for match in existing
+        }
+        new_lss = [
+            pair
+            for pair in dict.fromkeys(incoming_languagesystems)
+            if pair not in present
+        ]
         # If all new LSS are included in current, we're done.
-        needs_adding = False
-        for pair in incoming_languagesystems:
-            if pair not in new_lss:
-                new_lss.append(pair)
-                needs_adding = True
-        if not needs_adding:
+        if not new_lss:
             return
 
-        if first_lss_index is None:
-            first_lss_index = 0
-            last_lss_index = -1
+        def statement(pair: Tuple[str, str]) -> str:
+            script, language = pair
+            return "languagesystem %s %s;" % (script.strip(), language.strip())
 
-        # Hoist DFLT,dflt to first
-        if ("DFLT", "dflt") in new_lss:
-            new_lss.insert(0, new_lss.pop(new_lss.index(("DFLT", "dflt"))))
-
-        featurefile.statements[first_lss_index : last_lss_index + 1] = [
-            ast.LanguageSystemStatement(*pair) for pair in new_lss
-        ]
-        self.ufo1.features.text = featurefile.asFea()
+        # DFLT,dflt has to come first
+        leading = [pair for pair in new_lss if pair == ("DFLT", "dflt")]
+        trailing = [pair for pair in new_lss if pair != ("DFLT", "dflt")]
+        if existing:
+            start, end = existing[0].start(), existing[-1].end()
+        else:
+            start, end = 0, 0
+            leading += trailing
+            trailing = []
+        self.ufo1.features.text = (
+            text[:start]
+            + "".join(statement(pair) + "\n" for pair in leading)
+            + text[start:end]
+            + "".join("\n" + statement(pair) for pair in trailing)
+            + text[end:]
+        )
 
     def merge_kerning(self):
         groups1 = self.ufo1.groups
         groups2 = self.ufo2.groups
+        kerning1 = self.ufo1.kerning
+        incoming = self.incoming_glyphset
+        final = self.final_glyphset
         # Slim down the groups to only those in the glyph set
-        for glyph in groups2.keys():
-            groups2[glyph] = self.filter_glyphs_incoming(groups2[glyph])
+        for group_name, members in groups2.items():
+            groups2[group_name] = [glyph for glyph in members if glyph in incoming]
 
         # Clean glyphs to be imported from the target UFO kerning groups, so
         # importing the source kerning then does not lead to duplicate group
         # membership if their memebership changed.
-        kerning_groups_to_be_cleaned = []
+        kerning_groups_to_be_cleaned = set()
+        incoming_names = incoming.keys()
         for group_name in list(groups1.keys()):
             members = groups1[group_name]
-            new_members = [
-                member for member in members if member not in self.incoming_glyphset
-            ]
+            # Most groups don't mention any incoming glyph; leave those be
+            if members and incoming_names.isdisjoint(members):
+                continue
+            new_members = [member for member in members if member not in incoming]
             if new_members:
                 groups1[group_name] = new_members
             else:
                 del groups1[group_name]
-                kerning_groups_to_be_cleaned.append(group_name)
-        self.ufo1.kerning = {
-            (first, second): value
-            for (first, second), value in self.ufo1.kerning.items()
-            if first not in kerning_groups_to_be_cleaned
-            and second not in kerning_groups_to_be_cleaned
-        }
-
-        for (first, second), value in self.ufo2.kerning.items():
-            left_glyphs = [
-                glyph
-                for glyph in groups2.get(first, [first])
-                if glyph in self.final_glyphset
-            ]
-            right_glyphs = [
-                glyph
-                for glyph in groups2.get(second, [second])
-                if glyph in self.final_glyphset
-            ]
-
-            if not left_glyphs or not right_glyphs:
+                kerning_groups_to_be_cleaned.add(group_name)
+        if kerning_groups_to_be_cleaned:
+            for pair in [
+                pair
+                for pair in kerning1
+                if pair[0] in kerning_groups_to_be_cleaned
+                or pair[1] in kerning_groups_to_be_cleaned
+            ]:
+                del kerning1[pair]
+
+        merge_group = self.merge_group
+        # groups2 has already been slimmed down to incoming glyphs, which all
+        # end up in the final glyph set, so there is no need to filter the
+        # groups for every pair: a side is kept if it is a nonempty group or
+        # a glyph which will be in the font.
+        nonempty_groups = {name for name, members in groups2.items() if members}
+
+        def side_survives(side: str) -> bool:
+            if side in groups2:
+                return side in nonempty_groups
+            return side in final
+
+        for pair, value in self.ufo2.kerning.items():
+            first, second = pair
+            if not side_survives(first) or not side_survives(second):
                 continue
 
             # Just add for now. We should get fancy later
-            self.ufo1.kerning[(first, second)] = value
+            kerning1[pair] = value
             if first.startswith("public.kern"):
                 if first not in groups1:
                     groups1[first] = groups2[first]
                 else:
-                    groups1[first] = [
-                        glyph
-                        for glyph in set(groups1[first] + groups2[first])
-                        if glyph in self.final_glyphset
-                    ]
+                    groups1[first] = merge_group(groups1[first], groups2[first])
             if second.startswith("public.kern"):
                 if second not in groups1:
                     groups1[second] = groups2[second]
                 else:
-                    groups1[second] = [
-                        glyph
-                        for glyph in set(groups1[second] + groups2[second])
-                        if glyph in self.final_glyphset
-                    ]
+                    groups1[second] = merge_group(groups1[second], groups2[second])
+
+    def merge_group(self, members1: list[str], members2: list[str]) -> list[str]:
+        """Union two kerning groups, keeping the order of first appearance"""
+        return [
+            glyph
+            for glyph in dict.fromkeys(itertools.chain(members1, members2))
+            if glyph in self.final_glyphset
+        ]
 
     def merged_dotted_circle_anchors(self):
         if not self.merge_dotted_circle_anchors:
             return []
-        # Find both glyphs
-        ds2 = self.find_dotted_circle(self.ufo2)
+        # Find both glyphs. Look in the target first: it is empty when
+        # subsetting, and then there is no need to search the donor at all.
         ds1 = self.find_dotted_circle(self.ufo1)
-        if ds1 is None or ds2 is None:
+        if ds1 is None:
+            return []
+        ds2 = self.find_dotted_circle(self.ufo2)
+        if ds2 is None:
             return []
         anchors = list(ds1.anchors)  # The accessor is weird
         names = [anchor.name for anchor in anchors]
@@ -390,29 +501,45 @@ class UFOMerger:
 
     # Routines for merging font lib keys
     def merge_set(self, name, glyph, create_if_not_in_ufo1=False):
+        self.merge_set_many(name, [glyph], create_if_not_in_ufo1)
+
+    def merge_set_many(self, name, glyphs, create_if_not_in_ufo1=False):
+        """Like merge_set(), for several glyphs at once."""
         lib1 = self.ufo1.lib
         lib2 = self.ufo2.lib
-        if name not in lib2 or glyph not in lib2[name]:
+        if name not in lib2:
+            return
+        entries = set(lib2[name])
+        wanted = [glyph for glyph in dict.fromkeys(glyphs) if glyph in entries]
+        if not wanted:
             return
         if name not in lib1:
             if create_if_not_in_ufo1:
                 lib1[name] = []
             else:
                 return
-        if glyph not in lib1[name]:
-            lib1[name].append(glyph)
+        existing = set(lib1[name])
+        lib1[name].extend(glyph for glyph in wanted if glyph not in existing)
 
     def merge_dict(self, name, glyph, create_if_not_in_ufo1=False):
+        self.merge_dict_many(name, [glyph], create_if_not_in_ufo1)
+
+    def merge_dict_many(self, name, glyphs, create_if_not_in_ufo1=False):
+        """Like merge_dict(), for several glyphs at once."""
         lib1 = self.ufo1.lib
         lib2 = self.ufo2.lib
-        if name not in lib2 or glyph not in lib2[name]:
+        if name not in lib2:
+            return
+        entries = lib2[name]
+        wanted = {glyph: entries[glyph] for glyph in glyphs if glyph in entries}
+        if not wanted:
             return
         if name not in lib1:
             if create_if_not_in_ufo1:
                 lib1[name] = {}
             else:
                 return
-        lib1[name][glyph] = lib2[name][glyph]
+        lib1[name].update(wanted)
 
     def find_dotted_circle(self, ufo) -> Optional[Glyph]:
         if "dottedCircle" in ufo:
@@ -470,6 +597,10 @@ def merge_ufos(
         original_glyphlist: The original glyph list for UFO2, for when you
             already have a UFO with subset glyphs, but still need to subset
             the features.
+
+    Raises:
+        FeatureLibError: If the subset layout rules refer to glyphs or
+            classes which did not survive subsetting.
     """
     if layout_handling not in ["subset", "closure", "ignore"]:
         raise ValueError(f"Unknown layout handling mode '{layout_handling}'")
@@ -524,6 +655,10 @@ def subset_ufo(
         original_glyphlist: The original glyph list for UFO, for when you
             already have a UFO with subset glyphs, but still need to subset
             the features.
+
+    Raises:
+        FeatureLibError: If the subset layout rules refer to glyphs or
+            classes which did not survive subsetting.
     """
     new_ufo = Font(
         info=copy.deepcopy(ufo.info),
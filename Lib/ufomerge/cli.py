@@ -92,6 +92,12 @@ parser.add_argument(
 )
 
 
+def _read_lines(path):
+    """Read the non-empty lines of a text file, in order"""
+    with open(path, encoding="utf-8") as file:
+        return [line for line in file.read().splitlines() if line]
+
+
 def main(args=None):
     args = parser.parse_args(args)
     if args.replace_existing:
@@ -125,32 +131,30 @@ def main(args=None):
             return int(cp[2:], 16)
         return int(cp)
 
-    glyphs = set()
+    # Plain lists are fine here: the merger hashes them itself, and keeping
+    # the order given makes the output reproducible.
+    glyphs = []
     if args.glyphs == "*":
         glyphs = ufo2.keys()
     elif args.glyphs_file:
-        glyphs = set(open(args.glyphs_file, encoding="utf-8").read().splitlines())
+        glyphs = _read_lines(args.glyphs_file)
     elif args.glyphs:
-        glyphs = set(args.glyphs.split(","))
+        glyphs = args.glyphs.split(",")
     if args.codepoints:
-        codepoints = set(args.codepoints.split(","))
+        codepoints = args.codepoints.split(",")
     elif args.codepoints_file:
-        codepoints = set(
-            open(args.codepoints_file, encoding="utf-8").read().splitlines()
-        )
+        codepoints = _read_lines(args.codepoints_file)
     else:
         codepoints = []
     if codepoints:
         codepoints = [parse_cp(cp) for cp in codepoints]
 
     if args.exclude_glyphs:
-        exclude_glyphs = set(args.exclude_glyphs.split(","))
+        exclude_glyphs = args.exclude_glyphs.split(",")
     elif args.exclude_glyphs_file:
-        exclude_glyphs = set(
-            open(args.exclude_glyphs_file, encoding="utf-8").read().splitlines()
-        )
+        exclude_glyphs = _read_lines(args.exclude_glyphs_file)
     else:
-        exclude_glyphs = set()
+        exclude_glyphs = []
 
     merge_ufos(
         ufo1,
@@ -1,16 +1,20 @@
+import functools
+import itertools
 import logging
 from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import Dict, OrderedDict, Set
+from typing import Any, Set
 
 from fontTools.feaLib import ast
 from fontTools.misc.visitor import Visitor
 
 from ufomerge.utils import (
+    LazyJoin,
+    OrderedGlyphSet,
     filter_glyph_container,
-    filter_glyphs,
     filter_sequence,
     has_any_empty_slots,
+    is_empty_slot,
 )
 
 logger = logging.getLogger("ufomerge.layout")
@@ -28,28 +32,21 @@ def _deduplicate_class_defs(
     fresh_class_defs = []
 
     for class_name, class_defs in class_name_references.items():
-        by_glyph_set: dict[tuple[str, ...], list[ast.GlyphClassDefinition]]
+        # Group by unordered glyph set; only the emitted definitions get sorted.
+        by_glyph_set: dict[frozenset[str], list[ast.GlyphClassDefinition]]
         by_glyph_set = defaultdict(list)
         for class_def in class_defs:
-            glyph_set = tuple(sorted(class_def.glyphclass.glyphs.glyphSet()))
+            glyph_set = frozenset(class_def.glyphclass.glyphs.glyphSet())
             by_glyph_set[glyph_set].append(class_def.glyphclass)
 
+        # The parser fills glyph classes with plain glyph name strings, and
+        # they print just like GlyphName nodes, so don't wrap each one.
+        # Only rename the class if its references now disagree.
+        deduplicate = len(by_glyph_set) > 1
         for index, (glyph_set, class_defs) in enumerate(by_glyph_set.items(), start=1):
-            # No need to deduplicate.
-            if len(by_glyph_set) == 1:
-                new_class_def = ast.GlyphClassDefinition(
-                    class_name, ast.GlyphClass([ast.GlyphName(g) for g in glyph_set])
-                )
-                fresh_class_defs.append(new_class_def)
-                # Update references
-                for class_def in class_defs:
-                    class_def.name = class_name
-                continue
-
-            # Deduplicate
-            new_class_name = f"{class_name}_{index}"
+            new_class_name = f"{class_name}_{index}" if deduplicate else class_name
             new_class_def = ast.GlyphClassDefinition(
-                new_class_name, ast.GlyphClass([ast.GlyphName(g) for g in glyph_set])
+                new_class_name, ast.GlyphClass(sorted(glyph_set))
             )
             fresh_class_defs.append(new_class_def)
 
@@ -60,20 +57,59 @@ def _deduplicate_class_defs(
     return fresh_class_defs
 
 
+class _DispatchCachingVisitor(Visitor):
+    """A Visitor which resolves the visit functions for each node type once.
+
+    The stock Visitor walks the MRO of both the visitor and the visited node
+    on every call to find a visit function; feature files contain many nodes
+    of few types, so remember the answer per type instead.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch_cache = {}
+
+    @classmethod
+    def _register(celf, clazzes_attrs):
+        # Subclasses inherit registrations, so their answers may change too
+        stack = [celf]
+        while stack:
+            klass = stack.pop()
+            klass.__dict__.get("_dispatch_cache", {}).clear()
+            stack.extend(klass.__subclasses__())
+        return super()._register(clazzes_attrs)
+
+    @classmethod
+    def _visitorsFor(celf, thing, _default={}):
+        typ = type(thing)
+        visitors = celf._dispatch_cache.get(typ)
+        if visitors is None:
+            visitors = super()._visitorsFor(thing, _default)
+            celf._dispatch_cache[typ] = visitors
+        return visitors
+
+
+# The hooks above are private to fontTools; should a release drop them, do
+# without the cache rather than break.
+if not all(hasattr(Visitor, hook) for hook in ("_register", "_visitorsFor")):
+    _DispatchCachingVisitor = Visitor  # noqa: F811
+
+
 @dataclass
 class LayoutSubsetter:
     glyphset: Set[str]
     incoming_language_systems: list[tuple[str, str]] = field(init=False)
 
-    def subset(self, fea: ast.FeatureFile):
-        self.incoming_language_systems = [
-            (st.script, st.language)
-            for st in fea.statements
-            if isinstance(st, ast.LanguageSystemStatement)
-        ]
+    def __post_init__(self):
+        # Every rule tests membership and uses set operations on this, so
+        # accept any collection of names but make sure we hold a set.
+        if not isinstance(self.glyphset, (set, frozenset)):
+            self.glyphset = frozenset(self.glyphset)
 
+    def subset(self, fea: ast.FeatureFile):
         visitor = LayoutSubsetVisitor(self.glyphset)
         visitor.visit(fea)
+        self.incoming_language_systems = visitor.language_systems
         # At this point, all previous class definitions should have been
         # dropped from the AST, and we can insert new deduplicated ones.
         fresh_class_defs = _deduplicate_class_defs(visitor.class_name_references)
@@ -81,13 +117,15 @@ class LayoutSubsetter:
             fea.statements.insert(0, class_def)
 
 
-class LayoutSubsetVisitor(Visitor):
+class LayoutSubsetVisitor(_DispatchCachingVisitor):
     def __init__(self, glyphset):
         self.glyphset = glyphset
         self.class_name_references = defaultdict(list)
         self.dropped_lookups = set()
         self.dropped_features = set()
         self.referenced_mark_classes = set()
+        # Collected on the way through, to save a separate pass
+        self.language_systems = []
 
 
 @LayoutSubsetVisitor.register(ast.MarkClassDefinition)
@@ -95,7 +133,7 @@ def visit(visitor, mcd, *args, **kwargs):
     mcd.glyphs = filter_glyph_container(
         mcd.glyphs, visitor.glyphset, visitor.class_name_references
     )
-    mcd._keep = bool(mcd.glyphs.glyphSet())
+    mcd._keep = not is_empty_slot(mcd.glyphs)
     if mcd._keep:
         visitor.referenced_mark_classes.add(mcd.markClass.name)
     return False  # Needed to prevent recursion
@@ -119,9 +157,9 @@ def visit(visitor, st, *args, **kwargs):
         )
     ]
     st._keep = not (
-        any(not sequence.glyphSet() for sequence in st.prefix)
-        or any(not sequence.glyphSet() for sequence in st.suffix)
-        or not st.pos[0][0].glyphSet()
+        has_any_empty_slots(st.prefix)
+        or has_any_empty_slots(st.suffix)
+        or is_empty_slot(st.pos[0][0])
     )
 
 
@@ -158,7 +196,7 @@ def visit(visitor, st, *args, **kwargs):
         result = filter_glyph_container(
             getattr(st, method), visitor.glyphset, visitor.class_name_references
         )
-        if not result.glyphSet():
+        if is_empty_slot(result):
             keep = False
         setattr(st, method, result)
     st._keep = keep
@@ -167,6 +205,8 @@ def visit(visitor, st, *args, **kwargs):
 
 @LayoutSubsetVisitor.register(ast.SingleSubstStatement)
 def visit(visitor, st, *args, **kwargs):
+    # The context is filtered even if the statement turns out to be dropped,
+    # as that also records its class references.
     st.prefix = filter_sequence(
         st.prefix, visitor.glyphset, visitor.class_name_references
     )
@@ -177,19 +217,28 @@ def visit(visitor, st, *args, **kwargs):
         st._keep = False
         return
     originals = st.glyphs[0].glyphSet()
+    # Most single substitutions in a big font have nothing to do with the
+    # glyphs being kept; rule them out with one C-level set operation.
+    if visitor.glyphset.isdisjoint(originals):
+        st._keep = False
+        return False
     replaces = st.replacements[0].glyphSet()
     if len(replaces) == 1:
-        replaces = replaces * len(originals)
-    newmapping = OrderedDict()
-    for inglyph, outglyph in zip(originals, replaces):
-        if inglyph in visitor.glyphset and outglyph in visitor.glyphset:
-            newmapping[inglyph] = outglyph
+        replaces = itertools.repeat(replaces[0])
+    glyphset = visitor.glyphset
+    # Plain dicts keep insertion order, without OrderedDict's linked list
+    newmapping = {
+        inglyph: outglyph
+        for inglyph, outglyph in zip(originals, replaces)
+        if inglyph in glyphset and outglyph in glyphset
+    }
     if not newmapping:
         st._keep = False
         return
     if len(newmapping) == 1:
-        st.glyphs = [ast.GlyphName(list(newmapping.keys())[0])]
-        st.replacements = [ast.GlyphName(list(newmapping.values())[0])]
+        ((inglyph, outglyph),) = newmapping.items()
+        st.glyphs = [ast.GlyphName(inglyph)]
+        st.replacements = [ast.GlyphName(outglyph)]
     else:
         st.glyphs = [ast.GlyphClass(list(newmapping.keys()))]
         st.replacements = [ast.GlyphClass(list(newmapping.values()))]
@@ -215,7 +264,7 @@ def visit(visitor, st, *args, **kwargs):
         has_any_empty_slots(st.prefix)
         or has_any_empty_slots(st.replacement)
         or has_any_empty_slots(st.suffix)
-        or not st.glyph.glyphSet()
+        or is_empty_slot(st.glyph)
     )
     return False
 
@@ -238,7 +287,7 @@ def visit(visitor, st, *args, **kwargs):
         has_any_empty_slots(st.prefix)
         or has_any_empty_slots(st.glyphs)
         or has_any_empty_slots(st.suffix)
-        or not st.replacement.glyphSet()
+        or is_empty_slot(st.replacement)
     )
     return False
 
@@ -260,8 +309,8 @@ def visit(visitor, st, *args, **kwargs):
     st._keep = not (
         has_any_empty_slots(st.prefix)
         or has_any_empty_slots(st.suffix)
-        or not st.replacement.glyphSet()
-        or not st.glyph.glyphSet()
+        or is_empty_slot(st.replacement)
+        or is_empty_slot(st.glyph)
     )
     return False
 
@@ -271,7 +320,7 @@ def visit(visitor, st, *args, **kwargs):
     st.glyphclass = filter_glyph_container(
         st.glyphclass, visitor.glyphset, visitor.class_name_references
     )
-    st._keep = bool(st.glyphclass.glyphSet())
+    st._keep = not is_empty_slot(st.glyphclass)
     return False
 
 
@@ -309,8 +358,10 @@ def visit(visitor, st, *args, **kwargs):
 
 
 def _ignore_pos_sub(visitor, st, *args, **kwargs):
-    newcontexts = []
-    keep = True
+    # The context sequences are filtered in place, so st.chainContexts itself
+    # can stay as it is. Every context is filtered even once the statement
+    # is known to be dropped, as that also records its class references.
+    keep = bool(st.chainContexts)
     for prefix, glyphs, suffix in st.chainContexts:
         prefix[:] = filter_sequence(
             prefix, visitor.glyphset, visitor.class_name_references
@@ -321,16 +372,12 @@ def _ignore_pos_sub(visitor, st, *args, **kwargs):
         suffix[:] = filter_sequence(
             suffix, visitor.glyphset, visitor.class_name_references
         )
-        if (
+        if keep and (
             has_any_empty_slots(prefix)
             or has_any_empty_slots(suffix)
             or has_any_empty_slots(glyphs)
         ):
             keep = False
-        newcontexts.append((prefix, glyphs, suffix))
-    if not newcontexts:
-        keep = False
-    st.chainContexts = newcontexts
     st._keep = keep
 
 
@@ -348,17 +395,20 @@ def visit(visitor, st, *args, **kwargs):
 
 @LayoutSubsetVisitor.register(ast.Block)
 def visit(visitor, block, *args, **kwargs):
-    visitor.visitList(block.statements)
-    block.statements = [
-        statement for statement in block.statements if getattr(statement, "_keep", True)
-    ]
-    setattr(
-        block,
-        "_keep",
-        any(
-            getattr(statement, "_keep", True) is True for statement in block.statements
-        ),
-    )
+    statements = block.statements
+    visitor.visitList(statements)
+    # Compact the list in place, working out whether anything worth keeping
+    # (as opposed to "maybe" statements like comments) survives as we go.
+    kept = 0
+    effective = False
+    for statement in statements:
+        keep = getattr(statement, "_keep", True)
+        if keep:
+            statements[kept] = statement
+            kept += 1
+            effective = effective or keep is True
+    del statements[kept:]
+    block._keep = effective
     if isinstance(block, ast.LookupBlock) and not block._keep:
         logger.warning("Removing ineffective lookup %s", block.name)
         visitor.dropped_lookups.add(block.name)
@@ -386,14 +436,14 @@ def visit(visitor, st, *args, **kwargs):
         st.markAttachment = filter_glyph_container(
             st.markAttachment, visitor.glyphset, visitor.class_name_references
         )
-        if not st.markAttachment.glyphSet():
+        if is_empty_slot(st.markAttachment):
             st._keep = False
             return
     if st.markFilteringSet:
         st.markFilteringSet = filter_glyph_container(
             st.markFilteringSet, visitor.glyphset, visitor.class_name_references
         )
-        if not st.markFilteringSet.glyphSet():
+        if is_empty_slot(st.markFilteringSet):
             st._keep = False
             return
     st._keep = "maybe"
@@ -413,7 +463,8 @@ def visit(_visitor, st, *args, **kwargs):
 
 
 @LayoutSubsetVisitor.register(ast.LanguageSystemStatement)
-def visit(_visitor, st, *args, **kwargs):
+def visit(visitor, st, *args, **kwargs):
+    visitor.language_systems.append((st.script, st.language))
     st._keep = False
     return False
 
@@ -430,81 +481,122 @@ def visit(_visitor, st, *args, **kwargs):
     return False
 
 
-class LayoutClosureVisitor(Visitor):
+class LayoutClosureVisitor(_DispatchCachingVisitor):
     """Make sure that anything that can be produced by substitution rules
     added to the new UFO will also be added to the glyphset.
 
     After running the visitor, any glyphs that need to also be included
-    in the incoming set will be added to the incoming_glyphset dictionary.
+    in the incoming set will be added to the incoming_glyphset.
     """
 
-    def __init__(self, incoming_glyphset: Dict[str, bool], glyphset: Set[str]):
+    def __init__(self, incoming_glyphset: OrderedGlyphSet, glyphset: Set[str]):
         self.glyphset = glyphset
         self.incoming_glyphset = incoming_glyphset
+        # The closure pass never mutates glyph containers, so their contents
+        # can be remembered across statements and across closure rounds.
+        # Entries keep a reference to the container so that its id() stays
+        # unique for as long as the cache lives.
+        self.glyphset_cache: dict[int, tuple[Any, tuple[str, ...]]] = {}
+        # Set whenever a pass adds a glyph which was not in the glyphset
+        self.changed = False
+        # Size of the glyphset when each statement was last visited, keyed
+        # (and pinned) like glyphset_cache
+        self.visited_at: dict[int, tuple[Any, int]] = {}
+
+    def add_glyph(self, glyph: str, rule_type: str, source: Any) -> None:
+        """Mark a glyph produced by a substitution rule as incoming."""
+        self.incoming_glyphset.add(glyph)
+        if glyph not in self.glyphset:
+            self.glyphset.add(glyph)
+            self.changed = True
+        logger.debug(
+            "Adding %s used in %s substitution from %s", glyph, rule_type, source
+        )
+
+    def glyph_set(self, container) -> tuple[str, ...]:
+        """Return ``container.glyphSet()``, memoized by container identity."""
+        entry = self.glyphset_cache.get(id(container))
+        if entry is None:
+            if isinstance(container, str):
+                return (container,)
+            entry = (container, tuple(container.glyphSet()))
+            self.glyphset_cache[id(container)] = entry
+        return entry[1]
+
+
+def _skip_if_unchanged(handler):
+    """Don't revisit a substitution whose inputs can't have changed.
+
+    The glyphset only ever grows during closure, so if it is the same size
+    as when a statement was last visited, visiting it again adds nothing.
+    """
+
+    @functools.wraps(handler)
+    def visit(visitor, st, *args, **kwargs):
+        size = len(visitor.glyphset)
+        entry = visitor.visited_at.get(id(st))
+        if entry is not None and entry[1] == size:
+            return False
+        visitor.visited_at[id(st)] = (st, size)
+        return handler(visitor, st, *args, **kwargs)
+
+    return visit
 
 
 @LayoutClosureVisitor.register(ast.AlternateSubstStatement)
+@_skip_if_unchanged
 def visit(visitor, st, *args, **kwargs):
-    if not filter_glyphs(st.glyph.glyphSet(), visitor.glyphset):
+    if visitor.glyphset.isdisjoint(visitor.glyph_set(st.glyph)):
         return False
-    for glyph in st.replacement.glyphSet():
-        visitor.incoming_glyphset[glyph] = True
-        visitor.glyphset.add(glyph)
-        logger.debug(
-            "Adding %s used in alternate substitution from %s",
-            glyph,
-            st.glyph.asFea(),
-        )
+    add_glyph = visitor.add_glyph
+    for glyph in visitor.glyph_set(st.replacement):
+        add_glyph(glyph, "alternate", st.glyph)
 
 
 @LayoutClosureVisitor.register(ast.MultipleSubstStatement)
+@_skip_if_unchanged
 def visit(visitor, st, *args, **kwargs):
     # Fixup FontTools API breakage
     if isinstance(st.glyph, str):
         st.glyph = ast.GlyphName(st.glyph, st.location)
-    if not filter_glyphs(st.glyph.glyphSet(), visitor.glyphset):
+    if visitor.glyphset.isdisjoint(visitor.glyph_set(st.glyph)):
         return False
+    add_glyph = visitor.add_glyph
     for slot in st.replacement:
         if isinstance(slot, str):
             slot = ast.GlyphName(slot, st.location)
-        for glyph in slot.glyphSet():
-            visitor.incoming_glyphset[glyph] = True
-            visitor.glyphset.add(glyph)
-            logger.debug(
-                "Adding %s used in multiple substitution from %s",
-                glyph,
-                st.glyph.asFea(),
-            )
+        for glyph in visitor.glyph_set(slot):
+            add_glyph(glyph, "multiple", st.glyph)
 
 
 @LayoutClosureVisitor.register(ast.LigatureSubstStatement)
+@_skip_if_unchanged
 def visit(visitor, st, *args, **kwargs):
-    if has_any_empty_slots(filter_sequence(st.glyphs, visitor.glyphset)):
-        return False
+    # Only whether every slot still matches something matters here, so test
+    # that directly rather than filtering (and mutating) the slots.
+    glyphset = visitor.glyphset
+    for slot in st.glyphs:
+        if glyphset.isdisjoint(visitor.glyph_set(slot)):
+            return False
     if isinstance(st.replacement, str):
         st.replacement = ast.GlyphName(st.replacement, st.location)
-    for glyph in st.replacement.glyphSet():
-        visitor.incoming_glyphset[glyph] = True
-        visitor.glyphset.add(glyph)
-        logger.debug(
-            "Adding %s used in ligature substitution from %s",
-            glyph,
-            " ".join([x.asFea() for x in st.glyphs]),
-        )
+    source = LazyJoin(" ", st.glyphs)
+    add_glyph = visitor.add_glyph
+    for glyph in visitor.glyph_set(st.replacement):
+        add_glyph(glyph, "ligature", source)
 
 
 @LayoutClosureVisitor.register(ast.SingleSubstStatement)
+@_skip_if_unchanged
 def visit(visitor, st, *args, **kwargs):
-    originals = st.glyphs[0].glyphSet()
-    replaces = st.replacements[0].glyphSet()
+    originals = visitor.glyph_set(st.glyphs[0])
+    if visitor.glyphset.isdisjoint(originals):
+        return
+    replaces = visitor.glyph_set(st.replacements[0])
     if len(replaces) == 1:
-        replaces = replaces * len(originals)
+        replaces = itertools.repeat(replaces[0])
+    glyphset = visitor.glyphset
+    add_glyph = visitor.add_glyph
     for inglyph, outglyph in zip(originals, replaces):
-        if inglyph in visitor.glyphset:
-            visitor.incoming_glyphset[outglyph] = True
-            visitor.glyphset.add(outglyph)
-            logger.debug(
-                "Adding %s used in single substitution from %s",
-                outglyph,
-                inglyph,
-            )
+        if inglyph in glyphset:
+            add_glyph(outglyph, "single", inglyph)
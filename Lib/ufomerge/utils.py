@@ -1,9 +1,104 @@
 from typing import Any, Iterable, Mapping, Optional, List, Dict, Set
 from fontTools.feaLib import ast
 import copy
+import weakref
+
+
+class OrderedGlyphSet(dict):
+    """An insertion-ordered set of glyph names.
+
+    This is a dict under the hood (with every value ``None``), so membership
+    tests and iteration run at C speed, but it is used through a set-like
+    ``add``/``discard`` interface.
+    """
+
+    def add(self, glyph: str) -> None:
+        self[glyph] = None
+
+    def discard(self, glyph: str) -> None:
+        self.pop(glyph, None)
+
+
+class LazyJoin:
+    """Join items into a string only when formatted, for use as a log argument.
+
+    Logging defers %-interpolation until a record is actually emitted, but
+    arguments are still evaluated eagerly; this defers the join as well.
+    """
+
+    def __init__(self, separator: str, items: Iterable, item_format: str = "%s"):
+        self.separator = separator
+        self.items = items
+        self.item_format = item_format
+
+    def __str__(self) -> str:
+        return self.separator.join(self.item_format % (item,) for item in self.items)
+
+
+# Leaf nodes which neither the subsetter nor the closure visitor modify, so
+# copies of a feature file can share them with the original. (Statements,
+# even comments, get marked by the subsetter, so are never shared.)
+_SHARED_AST_TYPES = (ast.GlyphName, ast.Anchor, ast.ValueRecord)
+
+
+def clone_ast(node: Any, memo: Optional[Dict[int, Any]] = None) -> Any:
+    """Copy a feaLib AST deeply enough for it to be subset in place.
+
+    Statements, blocks and glyph and mark classes are copied once each, so
+    references between them point into the copy as with ``copy.deepcopy``.
+    Lists, tuples and dicts are copied wherever they appear, and leaves which
+    are never modified are shared with the original tree. This avoids the
+    reflection and memo overhead of ``copy.deepcopy`` on large feature files.
+    """
+    if memo is None:
+        memo = {}
+    # Test types rather than isinstance(), as weakref proxies (used by
+    # MarkClass.definitions) masquerade as the class of their referent.
+    node_type = type(node)
+    if node_type is list:
+        return [clone_ast(item, memo) for item in node]
+    if node_type is tuple:
+        return tuple(clone_ast(item, memo) for item in node)
+    if issubclass(node_type, dict):
+        return node_type((key, clone_ast(value, memo)) for key, value in node.items())
+    if not issubclass(node_type, (ast.Element, ast.MarkClass)) or issubclass(
+        node_type, _SHARED_AST_TYPES
+    ):
+        return node
+    clone = memo.get(id(node))
+    if clone is None:
+        clone = object.__new__(node_type)
+        memo[id(node)] = clone
+        clone.__dict__ = {
+            key: clone_ast(value, memo) for key, value in node.__dict__.items()
+        }
+        if issubclass(node_type, ast.MarkClass):
+            clone.definitions = _clone_mark_class_definitions(node, memo)
+    return clone
+
+
+def _clone_mark_class_definitions(
+    mark_class: ast.MarkClass, memo: Dict[int, Any]
+) -> list:
+    # MarkClass.definitions holds weak proxies, which can't be followed back
+    # to the definitions themselves; find those among the definitions which
+    # the class's glyphs map to, and point the copy at their clones.
+    referents = {}
+    for definition in mark_class.glyphs.values():
+        for ref in weakref.getweakrefs(definition):
+            referents[id(ref)] = definition
+    return [
+        weakref.proxy(clone_ast(referents[id(proxy)], memo))
+        for proxy in mark_class.definitions
+        if id(proxy) in referents
+    ]
 
 
 def filter_glyphs(glyphs: Iterable[str], glyphset: Set[str]) -> list[str]:
+    # Often nothing needs removing; issuperset() checks that in C, and gives
+    # up at the first missing glyph otherwise.
+    if type(glyphs) in (list, tuple) and glyphset.issuperset(glyphs):
+        return list(glyphs)
     return [glyph for glyph in glyphs if glyph in glyphset]
 
 
@@ -18,15 +113,76 @@ def filter_sequence(
     glyphset: Set[str],
     class_name_references: Optional[Dict[str, List[ast.GlyphClassName]]] = None,
 ) -> list[list[str]]:
-    newslots = []
-    for slot in slots:
-        if isinstance(slot, list):
-            newslots.append(filter_glyphs(slot, glyphset))
-        else:
-            newslots.append(
-                filter_glyph_container(slot, glyphset, class_name_references)
+    # Plain glyph lists are the common case; filter them inline, and keep
+    # the list itself when every glyph survives (the slot is replaced anyway).
+    return [
+        (
+            (
+                slot
+                if glyphset.issuperset(slot)
+                else [glyph for glyph in slot if glyph in glyphset]
             )
-    return newslots
+            if type(slot) is list
+            else filter_glyph_container(slot, glyphset, class_name_references)
+        )
+        for slot in slots
+    ]
+
+
+def _filter_glyph_name(container, glyphset, class_name_references):
+    # Single glyph
+    if container.glyph not in glyphset:
+        return ast.GlyphClass([])
+    return container
+
+
+def _filter_glyph_class(container, glyphset, class_name_references):
+    container.glyphs = filter_glyphs(container.glyphs, glyphset)
+    # I don't know what `original` is for, but it can undo subsetting
+    # when calling asFea():
+    container.original = []
+    return container
+
+
+def _filter_glyph_class_name(container, glyphset, class_name_references):
+    # Make a copy of the container, we'll deduplicate and correct names
+    # in a second pass later. Only the definition's name and its class's
+    # glyph list get replaced, so copying those two levels is enough.
+    glyphclass = copy.copy(container.glyphclass)
+    glyphclass.glyphs = classdef = copy.copy(glyphclass.glyphs)
+    container_copy = ast.GlyphClassName(glyphclass, location=container.location)
+    if class_name_references is not None:
+        name = glyphclass.name
+        copy_list = class_name_references[name]
+        glyphclass.name = name + "_" + str(len(copy_list))
+        copy_list.append(container_copy)
+
+    # Filter the class, see if there's anything left
+    classdef.glyphs = filter_glyphs(classdef.glyphs, glyphset)
+    if classdef.glyphs:
+        return container_copy
+    return ast.GlyphClass([])
+
+
+def _filter_mark_class_name(container, glyphset, class_name_references):
+    markclass = container.markClass
+    # A mark class is shared by every rule which names it, so after the first
+    # reference it has usually been filtered already.
+    if not glyphset.issuperset(markclass.glyphs):
+        markclass.glyphs = filter_glyph_mapping(markclass.glyphs, glyphset)
+    if markclass.glyphs:
+        return container
+    return ast.MarkClass([])
+
+
+# Looked up by exact type, as this is called for every glyph slot of every
+# rule; subclasses fall back to the isinstance() checks below.
+_CONTAINER_FILTERS = {
+    ast.GlyphName: _filter_glyph_name,
+    ast.GlyphClass: _filter_glyph_class,
+    ast.GlyphClassName: _filter_glyph_class_name,
+    ast.MarkClassName: _filter_mark_class_name,
+}
 
 
 def filter_glyph_container(
@@ -34,54 +190,37 @@ def filter_glyph_container(
     glyphset: Set[str],
     class_name_references: Optional[Dict[str, List[ast.GlyphClassName]]] = None,
 ) -> Any:
+    handler = _CONTAINER_FILTERS.get(type(container))
+    if handler is not None:
+        return handler(container, glyphset, class_name_references)
     if isinstance(container, str):
         # Grr.
         container = ast.GlyphName(container)
-    if isinstance(container, ast.GlyphName):
-        # Single glyph
-        if container.glyph not in glyphset:
-            return ast.GlyphClass([])
-        return container
-    if isinstance(container, ast.GlyphClass):
-        container.glyphs = filter_glyphs(container.glyphs, glyphset)
-        # I don't know what `original` is for, but it can undo subsetting
-        # when calling asFea():
-        container.original = []
-        return container
-    if isinstance(container, ast.GlyphClassName):
-        # Make a copy of the container, we'll deduplicate and correct names
-        # in a second pass later.
-        container_copy = copy.deepcopy(container)
-        if class_name_references is not None:
-            copy_list = class_name_references[container_copy.glyphclass.name]
-            container_copy.glyphclass.name = (
-                f"{container_copy.glyphclass.name}_{len(copy_list)}"
-            )
-            copy_list.append(container_copy)
-
-        # Filter the class, see if there's anything left
-        classdef = container_copy.glyphclass.glyphs
-        classdef.glyphs = filter_glyphs(classdef.glyphs, glyphset)
-        if classdef.glyphs:
-            return container_copy
-        return ast.GlyphClass([])
-    if isinstance(container, ast.MarkClassName):
-        markclass = container.markClass
-        markclass.glyphs = filter_glyph_mapping(markclass.glyphs, glyphset)
-        if markclass.glyphs:
-            return container
-        return ast.MarkClass([])
+    for container_type, handler in _CONTAINER_FILTERS.items():
+        if isinstance(container, container_type):
+            return handler(container, glyphset, class_name_references)
     raise ValueError(f"Unknown glyph container {container}")
 
 
+def is_empty_slot(slot: Any) -> bool:
+    # This is called for every slot of every rule, so avoid isinstance()
+    # and hasattr() and let the rare unexpected slot type fail instead.
+    slot_type = type(slot)
+    if slot_type is list:
+        return not slot
+    if slot_type is ast.GlyphName:
+        return False
+    if slot_type is ast.GlyphClass:
+        # glyphSet() would copy the whole class just to test it
+        return not slot.glyphs
+    try:
+        return not slot.glyphSet()
+    except AttributeError:
+        raise ValueError(f"Unknown slot type {slot!r}") from None
+
+
 def has_any_empty_slots(sequence: list) -> bool:
     for slot in sequence:
-        if isinstance(slot, list):
-            if len(slot) == 0:
-                return True
-        elif hasattr(slot, "glyphSet"):
-            if len(slot.glyphSet()) == 0:
-                return True
-        else:
-            raise ValueError
+        if is_empty_slot(slot):
+            return True
     return False
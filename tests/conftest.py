@@ -1,8 +1,33 @@
+import functools
 import pytest
 import ufoLib2
 from fontFeatures.feaLib import FeaParser
 import re
 
+# (pattern, replacement) pairs which normalise feature text for comparison
+FEATURE_NORMALIZATIONS = [
+    (re.compile(r"(?m)^\s+"), ""),
+    (re.compile(r"(?m)^.*lookupflag 0;"), ""),
+    (re.compile(r"(?m)#.*$"), ""),
+    (re.compile(r"(?m)^\s*;?\s*$"), ""),
+    (re.compile(r"\n\n"), "\n"),
+]
+
+
+@functools.lru_cache(maxsize=None)
+def features_glyphset(features: str) -> frozenset[str]:
+    """Return the glyphs used by the rules in a features string.
+
+    Parsing is the slow part of building a test font, and many tests start
+    from the same features, so parse each string once per session.
+    """
+    ff = FeaParser(features).parse()
+    glyphset = set()
+    for routine in ff.routines:
+        for rule in routine.rules:
+            glyphset |= set(rule.involved_glyphs)
+    return frozenset(glyphset)
+
 
 class Helpers:
     @staticmethod
@@ -14,11 +39,7 @@ class Helpers:
 
     @staticmethod
     def create_ufo_from_features(features: str) -> ufoLib2.Font:
-        ff = FeaParser(features).parse()
-        glyphset = set()
-        for routine in ff.routines:
-            for rule in routine.rules:
-                glyphset |= set(rule.involved_glyphs)
+        glyphset = features_glyphset(features)
         font = ufoLib2.Font()
         for glyph in glyphset:
             font.newGlyph(glyph)
@@ -30,14 +51,15 @@ class Helpers:
         ufo_glyphs = set(ufo.keys())
         assert ufo_glyphs == set(glyphs)
 
+    @staticmethod
+    def anchor_names(glyph) -> frozenset[str]:
+        return frozenset([anchor.name for anchor in glyph.anchors])
+
     @staticmethod
     def assert_features_similar(ufo: ufoLib2.Font, features: str):
         def transform(t):
-            t = re.sub(r"(?m)^\s+", "", t)
-            t = re.sub(r"(?m)^.*lookupflag 0;", "", t)
-            t = re.sub(r"(?m)#.*$", "", t)
-            t = re.sub(r"(?m)^\s*;?\s*$", "", t)
-            t = re.sub(r"\n\n", "\n", t)
+            for pattern, replacement in FEATURE_NORMALIZATIONS:
+                t = pattern.sub(replacement, t)
             return t
 
         assert transform(ufo.features.text) == transform(features)
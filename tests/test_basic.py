@@ -1,4 +1,4 @@
-from ufomerge import merge_ufos
+from ufomerge import UFOMerger, merge_ufos
 from ufoLib2.objects.component import Component
 from ufoLib2.objects.anchor import Anchor
 
@@ -21,6 +21,24 @@ def test_component_closure(helpers):
     helpers.assert_glyphset(ufo1, ["A", "B", "D", "comp"])
 
 
+def test_component_closure_nested(helpers):
+    ufo1 = helpers.create_ufo(["A"])
+    ufo2 = helpers.create_ufo(["Aacute", "Adieresis", "acutecomb", "dieresiscomb"])
+    ufo2.newGlyph("dot")
+
+    ufo2["Aacute"].components.append(Component("acutecomb"))
+    ufo2["Adieresis"].components.append(Component("dieresiscomb"))
+    ufo2["Adieresis"].components.append(Component("acutecomb"))
+    ufo2["dieresiscomb"].components.append(Component("dot"))
+    ufo2["dieresiscomb"].components.append(Component("dot"))
+
+    merge_ufos(ufo1, ufo2, glyphs=["Aacute", "Adieresis"])
+
+    helpers.assert_glyphset(
+        ufo1, ["A", "Aacute", "Adieresis", "acutecomb", "dieresiscomb", "dot"]
+    )
+
+
 def test_kerning_flat(helpers):
     ufo1 = helpers.create_ufo(["A", "B"])
     ufo2 = helpers.create_ufo(["C", "D", "E"])
@@ -56,19 +74,27 @@ def test_kerning_groups(helpers):
     This avoids stray kerning and glyphs being memebers of more than one group.
     """
     ufo1 = helpers.create_ufo(["A", "B"])
-    ufo1.groups["public.kern1.foo"] = ["A"]
-    ufo1.groups["public.kern2.foo"] = ["A"]
-    ufo1.kerning[("public.kern1.foo", "public.kern2.foo")] = 10
-    ufo1.kerning[("public.kern1.foo", "B")] = 20
-    ufo1.kerning[("A", "public.kern2.foo")] = 30
-    ufo1.kerning[("A", "A")] = 40
+    ufo1.groups = {
+        "public.kern1.foo": ["A"],
+        "public.kern2.foo": ["A"],
+    }
+    ufo1.kerning = {
+        ("public.kern1.foo", "public.kern2.foo"): 10,
+        ("public.kern1.foo", "B"): 20,
+        ("A", "public.kern2.foo"): 30,
+        ("A", "A"): 40,
+    }
     ufo2 = helpers.create_ufo(["A", "B"])
-    ufo2.groups["public.kern1.bar"] = ["A"]
-    ufo2.groups["public.kern2.bar"] = ["A"]
-    ufo2.kerning[("public.kern1.bar", "public.kern2.bar")] = 50
-    ufo2.kerning[("public.kern1.bar", "B")] = 60
-    ufo2.kerning[("A", "public.kern2.bar")] = 70
-    ufo2.kerning[("A", "A")] = 80
+    ufo2.groups = {
+        "public.kern1.bar": ["A"],
+        "public.kern2.bar": ["A"],
+    }
+    ufo2.kerning = {
+        ("public.kern1.bar", "public.kern2.bar"): 50,
+        ("public.kern1.bar", "B"): 60,
+        ("A", "public.kern2.bar"): 70,
+        ("A", "A"): 80,
+    }
 
     merge_ufos(ufo1, ufo2)
     assert ufo1.groups == {
@@ -83,6 +109,43 @@ def test_kerning_groups(helpers):
     }
 
 
+def test_kerning_group_union_order(helpers):
+    ufo1 = helpers.create_ufo(["C", "D", "E"])
+    ufo1.groups["public.kern1.foo"] = ["E", "C", "D"]
+    ufo1.kerning[("public.kern1.foo", "E")] = 10
+    ufo2 = helpers.create_ufo(["A", "B", "C"])
+    ufo2.groups["public.kern1.foo"] = ["B", "A", "C"]
+    ufo2.kerning[("public.kern1.foo", "A")] = 20
+    merge_ufos(ufo1, ufo2, glyphs=["A", "B"])
+    assert ufo1.groups["public.kern1.foo"] == ["E", "C", "D", "B", "A"]
+
+
+def test_lib_keys(helpers):
+    ufo1 = helpers.create_ufo(["A", "B"])
+    ufo1.lib["public.glyphOrder"] = ["B", "A"]
+    ufo2 = helpers.create_ufo(["A", "C", "D"])
+    ufo2.lib["public.glyphOrder"] = ["D", "C", "A"]
+    ufo2.lib["public.skipExportGlyphs"] = ["D", "A"]
+    ufo2.lib["public.postscriptNames"] = {"C": "uni0043"}
+    merge_ufos(ufo1, ufo2, glyphs=["A", "C", "D"])
+    assert ufo1.lib["public.glyphOrder"] == ["B", "A", "C", "D"]
+    assert ufo1.lib["public.skipExportGlyphs"] == ["A", "D"]
+    assert ufo1.lib["public.postscriptNames"] == {"C": "uni0043"}
+
+
+def test_lib_key_single_glyph(helpers):
+    ufo1 = helpers.create_ufo(["A"])
+    ufo1.lib["public.glyphOrder"] = ["A"]
+    ufo2 = helpers.create_ufo(["AB"])
+    ufo2.lib["public.glyphOrder"] = ["AB"]
+    ufo2.lib["public.postscriptNames"] = {"AB": "uniE000"}
+    merger = UFOMerger(ufo1, ufo2)
+    merger.merge_set("public.glyphOrder", "AB")
+    merger.merge_dict("public.postscriptNames", "AB", create_if_not_in_ufo1=True)
+    assert ufo1.lib["public.glyphOrder"] == ["A", "AB"]
+    assert ufo1.lib["public.postscriptNames"] == {"AB": "uniE000"}
+
+
 def test_dotted_circle(helpers):
     """Test that anchors are merged if both fonts contain a dotted circle glyph."""
     ufo1 = helpers.create_ufo(["A", "B", "dottedCircle"])
@@ -91,9 +154,8 @@ def test_dotted_circle(helpers):
     ufo2["dottedCircle"].appendAnchor(Anchor(0, -100, "bottom"))
 
     merge_ufos(ufo1, ufo2, merge_dotted_circle_anchors=False)
-    assert set(a.name for a in ufo1["dottedCircle"].anchors) == {
-        "bottom"
-    }  # We replaced.
+    # We replaced.
+    assert helpers.anchor_names(ufo1["dottedCircle"]) == {"bottom"}
 
     ufo1 = helpers.create_ufo(["A", "B", "dottedCircle"])
     ufo1["dottedCircle"].appendAnchor(Anchor(0, 100, "top"))
@@ -101,7 +163,7 @@ def test_dotted_circle(helpers):
     ufo2["dottedCircle"].appendAnchor(Anchor(0, -100, "bottom"))
 
     merge_ufos(ufo1, ufo2, merge_dotted_circle_anchors=True)
-    assert set(a.name for a in ufo1["dottedCircle"].anchors) == {"top", "bottom"}
+    assert helpers.anchor_names(ufo1["dottedCircle"]) == {"top", "bottom"}
 
 
 def test_28(helpers):
@@ -125,3 +187,30 @@ def test_28(helpers):
     assert "B" in ufo1
     assert ufo1["B"].height == 100
     assert ufo1["B"].unicode == 0x42  # fails
+
+
+def test_codepoint_replacement_keeps_unicode_order(helpers):
+    ufo1 = helpers.create_ufo(["A"])
+    ufo1["A"].unicodes = [0x41, 0x391, 0x410]
+    ufo2 = helpers.create_ufo(["Alpha"])
+    ufo2["Alpha"].unicodes = [0x391]
+
+    merge_ufos(ufo1, ufo2, codepoints=[0x391])
+
+    assert ufo1["A"].unicodes == [0x41, 0x410]
+    assert ufo1["Alpha"].unicodes == [0x391]
+
+
+def test_other_layers(helpers):
+    ufo1 = helpers.create_ufo(["A"])
+    ufo1.newLayer("background").newGlyph("A")
+    ufo2 = helpers.create_ufo(["B", "C"])
+    background = ufo2.newLayer("background")
+    background.newGlyph("B").width = 100
+    ufo2.newLayer("sketches").newGlyph("B")
+
+    merge_ufos(ufo1, ufo2)
+
+    assert set(ufo1.layers["background"].keys()) == {"A", "B"}
+    assert ufo1.layers["background"]["B"].width == 100
+    assert "sketches" not in ufo1.layers
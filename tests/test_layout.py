@@ -1,4 +1,12 @@
-from ufomerge import merge_ufos, subset_ufo
+import gc
+from io import StringIO
+
+from fontTools.feaLib import ast
+from fontTools.feaLib.error import FeatureLibError
+from fontTools.feaLib.parser import Parser
+from ufomerge import _parse_feature_file, merge_ufos, subset_ufo
+from ufomerge.layout import LayoutSubsetter, _DispatchCachingVisitor
+from ufomerge.utils import clone_ast
 import pytest
 
 
@@ -13,6 +21,43 @@ def test_layout_closure(helpers):
     helpers.assert_glyphset(ufo1, ["A", "B", "C"])
 
 
+def test_layout_closure_multiple_rounds(helpers):
+    ufo2 = helpers.create_ufo_from_features(
+        """
+        lookup foo { sub B by C; } foo;
+        feature bar1 { sub A by B; } bar1;
+        feature bar2 { sub B' lookup foo; } bar2;
+        """
+    )
+
+    ufo1 = subset_ufo(ufo2, glyphs=["A"], layout_handling="closure")
+    helpers.assert_glyphset(ufo1, ["A", "B", "C"])
+
+
+def test_layout_closure_rule_feeds_itself(helpers):
+    ufo2 = helpers.create_ufo_from_features(
+        "feature ss01 { sub [B A] by [C B]; } ss01;"
+    )
+
+    ufo1 = subset_ufo(ufo2, glyphs=["A"], layout_handling="closure")
+    helpers.assert_glyphset(ufo1, ["A", "B", "C"])
+
+
+def test_single_subst_to_one_glyph(helpers):
+    ufo2 = helpers.create_ufo_from_features("feature ss01 { sub [A B C] by D; } ss01;")
+
+    ufo1 = subset_ufo(ufo2, glyphs=["A", "C"], layout_handling="closure")
+    helpers.assert_glyphset(ufo1, ["A", "C", "D"])
+    helpers.assert_features_similar(
+        ufo1,
+        """
+feature ss01 {
+    sub [A C] by [D D];
+} ss01;
+    """,
+    )
+
+
 def test_ignorable_rule(helpers):
     ufo2 = helpers.create_ufo_from_features(
         "lookup ccmp1 { sub A B by C; sub A D by E; } ccmp1; feature ccmp { lookup ccmp1; } ccmp;"
@@ -110,10 +155,8 @@ def test_languagesystems(helpers):
       languagesystem latn dflt;
       languagesystem dev2 dflt;
       languagesystem dev2 NEP;
+      feature ccmp { sub A by B; } ccmp;
 
-      feature ccmp {
-      sub A by B;
-      } ccmp;
       feature ccmp {
         sub ka-deva by sa-deva;
         script dev2;
@@ -124,6 +167,50 @@ def test_languagesystems(helpers):
     )
 
 
+def test_languagesystems_added_to_bare_target(helpers):
+    ufo1 = helpers.create_ufo_from_features(
+        """# Comment stays put
+feature liga { sub A B by C; } liga;
+"""
+    )
+    ufo2 = helpers.create_ufo_from_features(
+        """
+      languagesystem arab dflt;
+      languagesystem DFLT dflt;
+      feature ccmp { sub D by E; } ccmp;
+    """
+    )
+    merge_ufos(ufo1, ufo2)
+    assert ufo1.features.text.startswith(
+        "languagesystem DFLT dflt;\n"
+        "languagesystem arab dflt;\n"
+        "# Comment stays put\n"
+        "feature liga { sub A B by C; } liga;\n"
+    )
+
+
+def test_languagesystems_on_one_line(helpers):
+    ufo1 = helpers.create_ufo_from_features(
+        """languagesystem DFLT dflt; languagesystem latn dflt; # languagesystem cyrl dflt;
+feature liga { sub A B by C; } liga;
+"""
+    )
+    ufo2 = helpers.create_ufo_from_features(
+        """
+      languagesystem latn dflt;
+      languagesystem grek dflt;
+      feature ccmp { sub D by E; } ccmp;
+    """
+    )
+    merge_ufos(ufo1, ufo2)
+    assert ufo1.features.text.startswith(
+        "languagesystem DFLT dflt; languagesystem latn dflt;\n"
+        "languagesystem grek dflt; # languagesystem cyrl dflt;\n"
+        "feature liga { sub A B by C; } liga;\n"
+    )
+    assert ufo1.features.text.count("languagesystem latn dflt;") == 1
+
+
 def test_drop_contextual_empty_class(helpers):
     ufo2 = helpers.create_ufo_from_features(
         """
@@ -150,6 +237,23 @@ def test_drop_contextual_empty_class(helpers):
     )
 
 
+def test_dropped_single_subst_keeps_context_class(helpers):
+    ufo2 = helpers.create_ufo(["a", "b", "x", "y"])
+    ufo2.features.text = """
+        @CONTEXT = [x y];
+        feature calt {
+            sub @CONTEXT a' by b;
+        } calt;
+        """
+    ufo1 = subset_ufo(ufo2, glyphs=["b", "x"])
+
+    helpers.assert_features_similar(
+        ufo1,
+        """
+        @CONTEXT = [x];""",
+    )
+
+
 def test_drop_mark_class(helpers):
     ufo2 = helpers.create_ufo_from_features(
         """
@@ -174,6 +278,22 @@ def test_drop_mark_class(helpers):
     )
 
 
+def test_dangling_references_are_not_written(helpers):
+    ufo2 = helpers.create_ufo(["a", "b", "c", "A", "B", "acute", "grave"])
+    ufo2.features.text = """
+        @BASES = [a b c A B];
+        markClass [acute grave] <anchor 100 200> @TOP;
+        feature mark {
+            pos base @BASES <anchor 100 300> mark @TOP;
+        } mark;
+        """
+    ufo1 = helpers.create_ufo(["a"])
+
+    with pytest.raises(FeatureLibError, match="@BASES"):
+        merge_ufos(ufo1, ufo2, glyphs=["acute", "a"])
+    assert "@BASES" not in ufo1.features.text
+
+
 def test_deduplicate_classes(helpers):
     ufo2 = helpers.create_ufo_from_features(
         """
@@ -267,3 +387,139 @@ def test_cull_unwanted_aalt(helpers) -> None:
     assert "aalt" in ufo1.features.text
     assert "ss01" not in ufo1.features.text
     assert "ss02" in ufo1.features.text
+
+
+def test_repeated_subset_does_not_share_layout(helpers):
+    ufo2 = helpers.create_ufo_from_features(
+        "feature liga { sub f i by f_i; sub f l by f_l; } liga;"
+    )
+
+    ufo1 = subset_ufo(ufo2, glyphs=["f", "i", "f_i"])
+    assert "f_l" not in ufo1.features.text
+
+    ufo1 = subset_ufo(ufo2, glyphs=["f", "l", "f_l"])
+    assert "f_l" in ufo1.features.text
+    assert "f_i" not in ufo1.features.text
+
+
+def test_included_features_are_reread(helpers, tmp_path):
+    ufo2 = helpers.create_ufo(["C", "D", "E"])
+    ufo2.features.text = "feature ccmp { include(sub.fea); } ccmp;"
+    included = tmp_path / "sub.fea"
+
+    included.write_text("sub C by D;")
+    ufo1 = subset_ufo(ufo2, glyphs=["C", "D", "E"], include_dir=tmp_path)
+    assert "sub C by D;" in ufo1.features.text
+
+    included.write_text("sub C by E;")
+    ufo1 = subset_ufo(ufo2, glyphs=["C", "D", "E"], include_dir=tmp_path)
+    assert "sub C by E;" in ufo1.features.text
+
+
+def test_subset_leaves_cached_features_untouched(helpers):
+    ufo2 = helpers.create_ufo(["a", "b", "c"])
+    ufo2.features.text = """
+        # A comment
+        feature liga { sub a b by c; } liga;
+        feature calt { sub c by a; } calt;
+        """
+    subset_ufo(ufo2, glyphs=["a", "b"])
+
+    cached = _parse_feature_file(ufo2.features.text, None, tuple(ufo2.keys()))
+    marked = []
+
+    def walk(node):
+        if isinstance(node, (list, tuple)):
+            for item in node:
+                walk(item)
+        elif isinstance(node, ast.Element):
+            if "_keep" in vars(node):
+                marked.append(node)
+            for value in vars(node).values():
+                walk(value)
+
+    walk(cached)
+    assert marked == []
+
+
+def test_clone_ast_is_independent():
+    original = Parser(
+        StringIO(
+            """
+            @LC = [a b];
+            markClass [acute] <anchor 100 200> @TOP;
+            lookup l1 { sub @LC by c; } l1;
+            feature liga { lookup l1; sub [a b] c by d; } liga;
+            """
+        ),
+        glyphNames=["a", "b", "c", "d", "acute"],
+    ).parse()
+    before = original.asFea()
+
+    clone = clone_ast(original)
+    assert clone.asFea() == before
+
+    feature = clone.statements[-1]
+    feature.statements[0].lookup.statements.clear()
+    feature.statements[1].glyphs[0].glyphs.remove("b")
+    clone.statements[1].markClass.glyphs.clear()
+    del clone.statements[0]
+
+    assert original.asFea() == before
+    # Shared structure within the tree is preserved
+    assert feature.statements[0].lookup is clone.statements[1]
+
+
+def test_clone_ast_mark_class_definitions():
+    original = Parser(
+        StringIO("markClass [acute grave] <anchor 100 200> @TOP;"),
+        glyphNames=["acute", "grave"],
+    ).parse()
+    clone = clone_ast(original)
+    del original
+    gc.collect()
+
+    definition = clone.statements[0]
+    definition.glyphs.glyphs.remove("grave")
+    assert definition.markClass.asFea() == "markClass [acute] <anchor 100 200> @TOP;"
+
+
+def test_visitor_registration_after_visit():
+    class BaseVisitor(_DispatchCachingVisitor):
+        pass
+
+    class ChildVisitor(BaseVisitor):
+        pass
+
+    fea = Parser(StringIO("feature ccmp { sub A by B; } ccmp;")).parse()
+    visited = []
+    ChildVisitor().visit(fea)
+
+    @BaseVisitor.register(ast.SingleSubstStatement)
+    def visit(visitor, st, *args, **kwargs):
+        visited.append(st)
+
+    ChildVisitor().visit(fea)
+    assert visited == [fea.statements[0].statements[0]]
+
+
+def test_ignore_contexts(helpers):
+    ufo2 = helpers.create_ufo(["A", "B", "C", "D", "E", "F"])
+    ufo2.features.text = """
+        feature calt {
+            ignore sub A B' [C D], E' F;
+            ignore sub A' D;
+            sub B by C;
+        } calt;
+    """
+
+    ufo1 = subset_ufo(ufo2, glyphs=["A", "B", "C", "E", "F"])
+    assert "ignore sub A B' [C], E' F;" in ufo1.features.text
+    assert "ignore sub A' D;" not in ufo1.features.text
+
+
+def test_subsetter_accepts_glyph_list():
+    fea = Parser(StringIO("feature ccmp { sub A by B; sub C by D; } ccmp;")).parse()
+    LayoutSubsetter(glyphset=["A", "B"]).subset(fea)
+    assert "sub A by B;" in fea.asFea()
+    assert "sub C by D;" not in fea.asFea()